@@ -73,7 +73,7 @@ MODEL_NAME="${MODEL_NAME:-gemini-2.5-flash}"
 DATADOG_SITE="${DATADOG_SITE:-us5.datadoghq.com}"
 ENVIRONMENT="${ENVIRONMENT:-production}"
 SERVICE_NAME="${SERVICE_NAME:-llm-observability-service}"
-MEMORY="${MEMORY:-1Gi}"
+MEMORY="${MEMORY:-2Gi}"
 CPU="${CPU:-1}"
 TIMEOUT="${TIMEOUT:-300}"
 
@@ -0,0 +1,10 @@
+import os
+
+# Gunicorn configuration for Cloud Run
+# /chat is an async Quart (ASGI) app, so each worker runs an asyncio event loop
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+worker_class = "uvicorn_worker.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+keepalive = 75
+timeout = 120
+graceful_timeout = 30
@@ -1,12 +1,21 @@
+import asyncio
+import datetime
 import os
 import time
-import uuid
+import secrets
 import hashlib
+import json
+import math
 import re
-from flask import Flask, request, jsonify
-from google.cloud import aiplatform
-from vertexai.generative_models import GenerativeModel
-import vertexai
+import statistics
+from collections import OrderedDict
+import faiss
+import numpy as np
+import google.auth
+import httpx
+from google.auth.transport.requests import Request as GoogleAuthRequest
+from quart import Quart, Response, request, jsonify
+from sentence_transformers import SentenceTransformer
 from datadog_api_client import ApiClient, Configuration
 from datadog_api_client.v2.api.metrics_api import MetricsApi
 from datadog_api_client.v2.model.metric_intake_type import MetricIntakeType
@@ -14,11 +23,8 @@ from datadog_api_client.v2.model.metric_payload import MetricPayload
 from datadog_api_client.v2.model.metric_point import MetricPoint
 from datadog_api_client.v2.model.metric_resource import MetricResource
 from datadog_api_client.v2.model.metric_series import MetricSeries
-from datadog_api_client.v1.api.logs_api import LogsApi
-from datadog_api_client.v1.model.http_log import HTTPLog
-from datadog_api_client.v1.model.http_log_item import HTTPLogItem
 
-app = Flask(__name__)
+app = Quart(__name__)
 
 # Configuration
 PROJECT_ID = os.getenv("GCP_PROJECT_ID")
@@ -28,25 +34,244 @@ DATADOG_API_KEY = os.getenv("DATADOG_API_KEY")
 DATADOG_APP_KEY = os.getenv("DATADOG_APP_KEY")
 SERVICE_NAME = "llm-observability-service"
 ENVIRONMENT = os.getenv("ENVIRONMENT", "dev")
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+CACHE_SIMILARITY_THRESHOLD = float(os.getenv("CACHE_SIMILARITY_THRESHOLD", "0.92"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+TELEMETRY_BATCH_SIZE = 500
+TELEMETRY_FLUSH_INTERVAL = 1.0  # seconds
+TELEMETRY_QUEUE_SIZE = 10000
+MAX_REQUEST_BYTES = 32_768
+MAX_PROMPT_CHARS = 8192
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)  # Refresh ~55 min into a 60 min token
 
-# Initialize Vertex AI
-vertexai.init(project=PROJECT_ID, location=LOCATION)
-model = GenerativeModel(MODEL_NAME)
+# Also caps bodies sent without a Content-Length header
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES
+
+# Hedging phrases that signal an uncertain answer
+HEDGING_RE = re.compile(
+    r'\b(?:might|possibly|perhaps|maybe|i think|could be|it seems|likely|probably)\b',
+    re.IGNORECASE,
+)
+
+# Vertex AI REST endpoints
+VERTEX_MODEL_URL = (
+    f"https://{LOCATION}-aiplatform.googleapis.com/v1/projects/{PROJECT_ID}"
+    f"/locations/{LOCATION}/publishers/google/models/{MODEL_NAME}"
+)
+VERTEX_URL = f"{VERTEX_MODEL_URL}:generateContent"
+VERTEX_STREAM_URL = f"{VERTEX_MODEL_URL}:streamGenerateContent?alt=sse"
+GENERATION_CONFIG = {
+    "temperature": 0,
+    "responseLogprobs": True,
+    "logprobs": 1,
+}
+
+# Vertex AI token refresh state, shared by all requests
+auth_request = GoogleAuthRequest()  # Reuses one session for token refreshes
+token_lock = asyncio.Lock()
+
+# Created in startup(), shared by all requests
+credentials = None
+http_client = None
+encoder = None
+response_cache = None
+telemetry_queue = None
+flusher_task = None
 
 # Datadog configuration
 dd_configuration = Configuration()
 dd_configuration.api_key["apiKeyAuth"] = DATADOG_API_KEY
 dd_configuration.api_key["appKeyAuth"] = DATADOG_APP_KEY
 dd_configuration.server_variables = {"site": "us5.datadoghq.com"}
+dd_api_client = ApiClient(dd_configuration)
+metrics_api = MetricsApi(dd_api_client)
+DATADOG_LOGS_URL = "https://http-intake.logs.us5.datadoghq.com/api/v2/logs"
+
+# Static parts of every metric series, built once
+DATADOG_RESOURCES = [MetricResource(name=SERVICE_NAME, type="service")]
+DATADOG_BASE_TAGS = [f"service:{SERVICE_NAME}", f"env:{ENVIRONMENT}"]
+REQUEST_METRICS = (  # (Datadog metric name, metrics_data key)
+    ("llm.request.latency_ms", "latency_ms"),
+    ("llm.self_confidence", "self_confidence"),
+    ("llm.hallucination_risk", "hallucination_risk"),
+    ("llm.answer_length", "answer_length"),
+    ("llm.token.count", "token_count"),
+)
+
+
+@app.before_serving
+async def startup():
+    """Load Google credentials and the prompt encoder, open the shared HTTP client
+    and start the telemetry flusher"""
+    global credentials, http_client, encoder, response_cache, telemetry_queue, flusher_task
+    credentials, _ = google.auth.default(
+        scopes=["https://www.googleapis.com/auth/cloud-platform"]
+    )
+    http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=60,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    )
+    encoder = await asyncio.to_thread(SentenceTransformer, EMBEDDING_MODEL)
+    response_cache = SemanticCache(
+        encoder.get_sentence_embedding_dimension(),
+        CACHE_SIMILARITY_THRESHOLD,
+        CACHE_MAX_ENTRIES,
+    )
+    telemetry_queue = asyncio.Queue(maxsize=TELEMETRY_QUEUE_SIZE)
+    flusher_task = asyncio.create_task(flush_telemetry())
+
+
+@app.after_serving
+async def shutdown():
+    """Flush queued telemetry, stop the flusher and close the shared clients"""
+    await telemetry_queue.put(None)  # Sentinel: flush what is queued, then stop
+    await flusher_task
+    await http_client.aclose()
+    dd_api_client.close()
+
+
+def token_is_fresh() -> bool:
+    """Whether the cached token is valid for at least TOKEN_REFRESH_MARGIN"""
+    if not credentials.valid:
+        return False
+    if credentials.expiry is None:
+        return True  # Token never expires
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return credentials.expiry - TOKEN_REFRESH_MARGIN > now
+
+
+async def get_access_token() -> str:
+    """
+    Return the cached bearer token for Vertex AI.
+    Refreshes it shortly before expiry; concurrent requests share one refresh.
+    """
+    if not token_is_fresh():
+        async with token_lock:
+            if not token_is_fresh():  # Another request may have refreshed it
+                await asyncio.to_thread(credentials.refresh, auth_request)
+    return credentials.token
+
+
+def build_generate_request(prompt: str) -> dict:
+    """Build the generateContent request body for a single-turn prompt"""
+    return {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": GENERATION_CONFIG,
+    }
+
+
+async def generate_content(prompt: str) -> dict:
+    """Call Gemini through the Vertex AI generateContent REST endpoint"""
+    token = await get_access_token()
+    response = await http_client.post(
+        VERTEX_URL,
+        headers={"Authorization": f"Bearer {token}"},
+        json=build_generate_request(prompt),
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def stream_generate_content(prompt: str):
+    """Stream Gemini's answer from the streamGenerateContent endpoint, one chunk dict at a time"""
+    token = await get_access_token()
+    async with http_client.stream(
+        "POST",
+        VERTEX_STREAM_URL,
+        headers={"Authorization": f"Bearer {token}"},
+        json=build_generate_request(prompt),
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("data:"):
+                yield json.loads(line[len("data:"):])
+
+
+def get_response_text(response: dict) -> str:
+    """Concatenate the text parts of the first candidate"""
+    try:
+        parts = response["candidates"][0]["content"]["parts"]
+    except (KeyError, IndexError):
+        raise ValueError(f"Gemini returned no content: {response.get('promptFeedback', response)}")
+    return "".join(part.get("text", "") for part in parts)
+
+
+def get_chunk_text(chunk: dict) -> str:
+    """Concatenate the text parts of a streamed chunk; empty if it carries none"""
+    candidates = chunk.get("candidates") or [{}]
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return "".join(part.get("text", "") for part in parts)
+
+
+def get_chosen_logprobs(response: dict) -> list:
+    """Return the chosen-token logprobs of the first candidate, if any were returned"""
+    candidates = response.get("candidates") or [{}]
+    return candidates[0].get("logprobsResult", {}).get("chosenCandidates", [])
+
+
+def get_token_count(response: dict, default: int = 0) -> int:
+    """Return usageMetadata.totalTokenCount, or default if usage was not reported"""
+    usage = response.get("usageMetadata")
+    return usage.get("totalTokenCount", default) if usage else default
+
+
+class SemanticCache:
+    """
+    In-process LRU cache of responses keyed by normalized prompt embedding.
+    A lookup hits when the nearest cached prompt has cosine similarity >= threshold.
+    Methods never await, so they cannot interleave on the event loop.
+    """
+
+    def __init__(self, dim: int, threshold: float, max_entries: int):
+        self.index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        self.entries = OrderedDict()  # id -> (response_text, answer_length, confidence, risk)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.next_id = 0
+
+    def get(self, embedding: np.ndarray):
+        if not self.entries:
+            return None
+        scores, ids = self.index.search(embedding, 1)
+        entry_id = int(ids[0, 0])
+        if entry_id == -1 or scores[0, 0] < self.threshold:
+            return None
+        self.entries.move_to_end(entry_id)
+        return self.entries[entry_id]
+
+    def put(self, embedding: np.ndarray, entry: tuple):
+        if len(self.entries) >= self.max_entries:
+            oldest_id, _ = self.entries.popitem(last=False)
+            self.index.remove_ids(np.array([oldest_id], dtype=np.int64))
+        self.index.add_with_ids(embedding, np.array([self.next_id], dtype=np.int64))
+        self.entries[self.next_id] = entry
+        self.next_id += 1
+
+
+def embed_prompt(prompt: str) -> np.ndarray | None:
+    """
+    Encode prompt into a unit-length embedding of shape (1, dim).
+    Returns None when the prompt is longer than the encoder's max_seq_length:
+    the encoder would truncate it, so prompts differing only past the cut-off
+    would share an embedding and one could be served the other's answer.
+    """
+    token_ids = encoder.tokenizer(prompt, verbose=False)["input_ids"]
+    if len(token_ids) > encoder.max_seq_length:
+        return None
+    return encoder.encode([prompt], normalize_embeddings=True)
+
 
 def hash_prompt(prompt: str) -> str:
-    """Create SHA256 hash of prompt for privacy-safe logging"""
-    return hashlib.sha256(prompt.encode()).hexdigest()[:16]
+    """Create 64-bit BLAKE2b hash of prompt (16 hex chars) for privacy-safe logging"""
+    return hashlib.blake2b(prompt.encode(), digest_size=8).hexdigest()
 
 
-def calculate_hallucination_risk(response_text: str, prompt: str, confidence: float) -> float:
+def calculate_hallucination_risk(response_text: str, prompt_length: int, response_length: int,
+                                 confidence: float) -> float:
     """
     Calculate hallucination risk score (0.0 - 1.0) using heuristics.
+    Lengths are word counts, computed once by the caller.
     Higher = more risk
     """
     risk_score = 0.0
@@ -56,16 +281,12 @@ def calculate_hallucination_risk(response_text: str, prompt: str, confidence: fl
     risk_score += confidence_risk * 0.4
     
     # Factor 2: Hedging language (30% weight)
-    hedging_words = ['might', 'possibly', 'perhaps', 'maybe', 'i think', 
-                     'could be', 'it seems', 'likely', 'probably']
-    text_lower = response_text.lower()
-    hedging_count = sum(1 for word in hedging_words if word in text_lower)
+    # Count each distinct hedging phrase once, in a single pass
+    hedging_count = len({match.lower() for match in HEDGING_RE.findall(response_text)})
     hedging_risk = min(hedging_count / 5.0, 1.0)  # Cap at 1.0
     risk_score += hedging_risk * 0.3
     
     # Factor 3: Excessive verbosity (30% weight)
-    response_length = len(response_text.split())
-    prompt_length = len(prompt.split())
     verbosity_ratio = response_length / max(prompt_length, 1)
     verbosity_risk = min(verbosity_ratio / 50.0, 1.0)  # Cap at 50x ratio
     risk_score += verbosity_risk * 0.3
@@ -73,221 +294,368 @@ def calculate_hallucination_risk(response_text: str, prompt: str, confidence: fl
     return min(risk_score, 1.0)
 
 
-def get_self_confidence(model_instance, original_prompt: str, original_response: str) -> float:
+def confidence_from_logprobs(chosen: list) -> float:
     """
-    Ask the model to rate its confidence in the answer it gave.
-    Returns score between 0.0 and 1.0
+    Derive a confidence score from the token logprobs of the answer.
+    Returns the geometric mean of the chosen token probabilities (0.0 - 1.0)
     """
-    confidence_prompt = f"""You previously answered this question:
-Question: {original_prompt}
-Your answer: {original_response}
+    if not chosen:
+        return 0.5  # Logprobs not returned by this model
+    # Zero-valued fields are omitted from the JSON response
+    return math.exp(statistics.fmean(c.get("logProbability", 0.0) for c in chosen))
+
 
-On a scale from 0.0 to 1.0, how confident are you that your answer is accurate and complete?
-Respond with ONLY a number between 0.0 and 1.0, nothing else."""
+def build_metric_series(metrics_data: dict, timestamp: int) -> list:
+    """Build the Datadog metric series for one request"""
+    tags = [
+        f"model_name:{metrics_data['model_name']}",
+        f"cache_hit:{str(metrics_data['cache_hit']).lower()}",
+        *DATADOG_BASE_TAGS
+    ]
     
+    # Create metric series for each metric
+    return [
+        MetricSeries(
+            metric=metric_name,
+            type=MetricIntakeType.UNSPECIFIED,
+            points=[MetricPoint(timestamp=timestamp, value=metrics_data[key])],
+            resources=DATADOG_RESOURCES,
+            tags=tags,
+        )
+        for metric_name, key in REQUEST_METRICS
+        if metrics_data[key] is not None  # latency_ms is unset on cache hits
+    ]
+
+
+def build_error_series(timestamp: int) -> list:
+    """Build the Datadog error count series for one failed request"""
+    return [
+        MetricSeries(
+            metric="llm.error.count",
+            type=MetricIntakeType.UNSPECIFIED,
+            points=[MetricPoint(timestamp=timestamp, value=1.0)],
+            tags=DATADOG_BASE_TAGS
+        )
+    ]
+
+
+def build_log_entry(log_data: dict) -> dict:
+    """Build a structured Datadog log entry for one request"""
+    return {
+        "ddsource": "llm-observability",
+        "ddtags": f"env:{ENVIRONMENT},service:{SERVICE_NAME}",
+        "hostname": SERVICE_NAME,
+        "message": f"LLM request completed: request_id={log_data.get('request_id', 'unknown')}",
+        "service": SERVICE_NAME,
+        **log_data
+    }
+
+
+def submit_metrics(series: list):
+    """Send metric series to Datadog in one call"""
     try:
-        response = model_instance.generate_content(confidence_prompt)
-        confidence_text = response.text.strip()
-        # Extract number from response
-        match = re.search(r'0?\.\d+|1\.0|0|1', confidence_text)
-        if match:
-            return float(match.group())
-        return 0.5  # Default if parsing fails
+        metrics_api.submit_metrics(body=MetricPayload(series=series))
     except Exception as e:
-        print(f"Error getting self-confidence: {e}")
-        return 0.5
+        print(f"Error sending metrics to Datadog: {e}")
 
 
-def send_metrics_to_datadog(metrics_data: dict):
-    """Send custom metrics to Datadog"""
+async def submit_logs(log_entries: list):
+    """Send log entries to the Datadog logs intake as one JSON array"""
     try:
-        with ApiClient(dd_configuration) as api_client:
-            api_instance = MetricsApi(api_client)
-            
-            timestamp = int(time.time())
-            tags = [
-                f"model_name:{metrics_data['model_name']}",
-                f"service:{SERVICE_NAME}",
-                f"env:{ENVIRONMENT}"
-            ]
-            
-            series = []
-            
-            # Create metric series for each metric
-            for metric_name, value in [
-                ("llm.request.latency_ms", metrics_data["latency_ms"]),
-                ("llm.self_confidence", metrics_data["self_confidence"]),
-                ("llm.hallucination_risk", metrics_data["hallucination_risk"]),
-                ("llm.answer_length", metrics_data["answer_length"]),
-                ("llm.token.count", metrics_data.get("token_count", 0))
-            ]:
-                series.append(
-                    MetricSeries(
-                        metric=metric_name,
-                        type=MetricIntakeType.UNSPECIFIED,
-                        points=[
-                            MetricPoint(
-                                timestamp=timestamp,
-                                value=value,
-                            )
-                        ],
-                        resources=[
-                            MetricResource(
-                                name=SERVICE_NAME,
-                                type="service",
-                            )
-                        ],
-                        tags=tags,
-                    )
-                )
-            
-            payload = MetricPayload(series=series)
-            api_instance.submit_metrics(body=payload)
-            
+        response = await http_client.post(
+            DATADOG_LOGS_URL,
+            headers={"DD-API-KEY": DATADOG_API_KEY},
+            json=log_entries,
+        )
+        response.raise_for_status()
     except Exception as e:
-        print(f"Error sending metrics to Datadog: {e}")
+        print(f"Error sending logs to Datadog: {e}")
 
 
+async def submit_telemetry(batch: list):
+    """Send a batch of queued telemetry to Datadog as one metrics and one logs call"""
+    series = []
+    log_entries = []
+    for kind, timestamp, data in batch:
+        if kind == "metrics":
+            series.extend(build_metric_series(data, timestamp))
+        elif kind == "error":
+            series.extend(build_error_series(timestamp))
+        else:
+            log_entries.append(build_log_entry(data))
+    
+    submissions = []
+    if series:
+        submissions.append(asyncio.to_thread(submit_metrics, series))
+    if log_entries:
+        submissions.append(submit_logs(log_entries))
+    await asyncio.gather(*submissions)
+
 
-def send_logs_to_datadog(log_data):
-    """Send structured logs to Datadog"""
+def queue_telemetry(kind: str, data: dict = None):
+    """Queue telemetry for the background flusher; never blocks the request"""
     try:
-        with ApiClient(dd_configuration) as api_client:
-            api_instance = LogsApi(api_client)
-            
-            # Convert all numeric values to strings for Datadog logs API
-            log_data_str = {}
-            for key, value in log_data.items():
-                if isinstance(value, (int, float)):
-                    log_data_str[key] = str(value)
-                else:
-                    log_data_str[key] = value
-            
-            body = HTTPLog([
-                HTTPLogItem(
-                    ddsource="llm-observability",
-                    ddtags=f"env:{ENVIRONMENT},service:{SERVICE_NAME}",
-                    hostname=SERVICE_NAME,
-                    message=f"LLM request completed: request_id={log_data.get('request_id', 'unknown')}",
-                    service=SERVICE_NAME,
-                    **log_data_str  # Use string-converted version
-                ),
-            ])
-            
-            api_instance.submit_log(body=body)
+        telemetry_queue.put_nowait((kind, int(time.time()), data))  # Epoch seconds for metric timestamps
+    except asyncio.QueueFull:
+        print(f"Telemetry queue full, dropping {kind} record")
+
+
+async def flush_telemetry():
+    """
+    Drain the telemetry queue, submitting up to a batch per flush interval.
+    Returns after flushing once the None sentinel is received.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await telemetry_queue.get()]
+        deadline = loop.time() + TELEMETRY_FLUSH_INTERVAL
+        while len(batch) < TELEMETRY_BATCH_SIZE and batch[-1] is not None:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(telemetry_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        stopping = batch[-1] is None
+        if stopping:
+            batch.pop()
+        if batch:
+            try:
+                await submit_telemetry(batch)
+            except Exception as e:
+                print(f"Error flushing telemetry: {e}")
+        if stopping:
+            return
+
+
+def score_and_cache(prompt: str, embedding: np.ndarray | None, response_text: str,
+                    chosen: list) -> tuple:
+    """
+    Score a fresh Gemini answer and add it to the semantic cache
+    (skipped for prompts too long to embed).
+    Returns (answer_length, confidence_score, hallucination_risk)
+    """
+    answer_length = len(response_text.split())
+    
+    # Confidence from the same call's token logprobs
+    confidence_score = confidence_from_logprobs(chosen)
+    
+    # Calculate hallucination risk
+    hallucination_risk = calculate_hallucination_risk(
+        response_text, len(prompt.split()), answer_length, confidence_score
+    )
+    
+    if embedding is not None:
+        response_cache.put(
+            embedding, (response_text, answer_length, confidence_score, hallucination_risk)
+        )
+    return answer_length, confidence_score, hallucination_risk
+
+
+def record_success(request_id: str, prompt: str, answer_length: int, confidence_score: float,
+                   hallucination_risk: float, token_count: int, cache_hit: bool,
+                   latency_ms: float | None, start_time: float) -> dict:
+    """
+    Queue telemetry for a completed request and return its response metadata.
+    latency_ms is the Gemini call time, or None when served from the cache.
+    """
+    metrics_data = {
+        "model_name": MODEL_NAME,
+        "latency_ms": latency_ms,
+        "self_confidence": confidence_score,
+        "hallucination_risk": hallucination_risk,
+        "answer_length": answer_length,
+        "token_count": token_count,
+        "cache_hit": cache_hit
+    }
+    
+    log_data = {
+        "request_id": request_id,
+        "prompt_hash": hash_prompt(prompt),
+        "model_name": MODEL_NAME,
+        "latency_ms": latency_ms,
+        "hallucination_risk": hallucination_risk,
+        "self_confidence": confidence_score,
+        "answer_length": answer_length,
+        "cache_hit": cache_hit,
+        "status": "success"
+    }
+    
+    # Queue telemetry for the background flusher
+    queue_telemetry("metrics", metrics_data)
+    queue_telemetry("log", log_data)
+    
+    end_time = time.perf_counter()
+    return {
+        "latency_ms": round((end_time - start_time) * 1000, 2),
+        "confidence": round(confidence_score, 3),
+        "hallucination_risk": round(hallucination_risk, 3),
+        "model": MODEL_NAME,
+        "cache_hit": cache_hit
+    }
+
+
+def record_error(request_id: str, error: str, start_time: float):
+    """Queue the error log and error count metric for a failed request"""
+    error_time = time.perf_counter()
+    error_data = {
+        "request_id": request_id,
+        "error": error,
+        "latency_ms": (error_time - start_time) * 1000,
+        "status": "error"
+    }
+    queue_telemetry("log", error_data)
+    
+    # Send error metric
+    queue_telemetry("error")
+
+
+def sse_event(data: dict) -> str:
+    """Format data as a Server-Sent Events message"""
+    return f"data: {json.dumps(data)}\n\n"
+
+
+async def stream_chat(request_id: str, prompt: str, embedding: np.ndarray | None, cached,
+                      start_time: float):
+    """
+    Stream the answer as Server-Sent Events: one {"delta": ...} event per chunk,
+    then a final {"done": true, ...} event with the request metadata.
+    Telemetry is recorded once the full answer has been seen.
+    """
+    recorded = False
+    try:
+        if cached:
+            response_text, answer_length, confidence_score, hallucination_risk = cached
+            token_count = 0
+            latency_ms = None
+            yield sse_event({"delta": response_text})
+        else:
+            llm_start = time.perf_counter()
+            text_parts = []
+            chosen = []
+            token_count = 0
+            async for chunk in stream_generate_content(prompt):
+                text = get_chunk_text(chunk)
+                chosen.extend(get_chosen_logprobs(chunk))
+                token_count = get_token_count(chunk, token_count)
+                if text:
+                    text_parts.append(text)
+                    yield sse_event({"delta": text})
+            latency_ms = (time.perf_counter() - llm_start) * 1000
             
+            if not text_parts:
+                raise ValueError("Gemini returned no content")
+            response_text = "".join(text_parts)
+            answer_length, confidence_score, hallucination_risk = score_and_cache(
+                prompt, embedding, response_text, chosen
+            )
+        
+        metadata = record_success(
+            request_id, prompt, answer_length, confidence_score,
+            hallucination_risk, token_count, cached is not None,
+            latency_ms, start_time,
+        )
+        recorded = True
+        yield sse_event({"done": True, "request_id": request_id, "metadata": metadata})
+        
     except Exception as e:
-        print(f"Error sending logs to Datadog: {e}")
+        record_error(request_id, str(e), start_time)
+        recorded = True
+        yield sse_event({"error": str(e), "request_id": request_id})
+    finally:
+        # Client disconnected before the stream finished
+        if not recorded:
+            record_error(request_id, "stream closed before completion", start_time)
+
+
+@app.errorhandler(413)
+async def request_too_large(error):
+    """Body exceeded MAX_CONTENT_LENGTH while being read"""
+    return jsonify({"error": "prompt too large"}), 413
 
 
 @app.route('/health', methods=['GET'])
-def health():
+async def health():
     """Health check endpoint"""
     return jsonify({"status": "healthy"}), 200
 
 
 @app.route('/chat', methods=['POST'])
-def chat():
+async def chat():
     """Main chat endpoint with full observability"""
-    request_id = str(uuid.uuid4())
-    start_time = time.time()
+    # Reject oversized bodies before reading them
+    if request.content_length and request.content_length > MAX_REQUEST_BYTES:
+        return jsonify({"error": "prompt too large"}), 413
     
+    # Parse request; a body that is not UTF-8 JSON is treated as a missing prompt
     try:
-        # Parse request
-        data = request.get_json()
-        prompt = data.get('prompt', '')
-        
-        if not prompt:
-            return jsonify({"error": "prompt is required"}), 400
-        
-        # Call Gemini
-        llm_start = time.time()
-        response = model.generate_content(prompt)
-        llm_end = time.time()
+        data = json.loads(await request.get_data(cache=False))
+    except ValueError:
+        data = None
+    prompt = data.get('prompt') if isinstance(data, dict) else None
+    
+    if not isinstance(prompt, str) or not prompt:
+        return jsonify({"error": "prompt is required"}), 400
+    if len(prompt) > MAX_PROMPT_CHARS:
+        return jsonify({"error": "prompt too large"}), 413
+    
+    request_id = secrets.token_hex(16)
+    start_time = time.perf_counter()
+    
+    try:
+        # Serve near-duplicate prompts from the semantic cache; prompts too
+        # long to embed without truncation always go to Gemini
+        embedding = await asyncio.to_thread(embed_prompt, prompt)
+        cached = response_cache.get(embedding) if embedding is not None else None
+        cache_hit = cached is not None
         
-        response_text = response.text
+        if data.get('stream'):
+            response = Response(
+                stream_chat(request_id, prompt, embedding, cached, start_time),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache"},
+            )
+            # Long answers outlast Quart's 60s RESPONSE_TIMEOUT; Cloud Run's
+            # request timeout still bounds the stream
+            response.timeout = None
+            return response
         
-        # Get self-confidence score
-        confidence_score = get_self_confidence(model, prompt, response_text)
+        if cache_hit:
+            response_text, answer_length, confidence_score, hallucination_risk = cached
+            token_count = 0
+            latency_ms = None
+        else:
+            # Call Gemini
+            llm_start = time.perf_counter()
+            response = await generate_content(prompt)
+            latency_ms = (time.perf_counter() - llm_start) * 1000
+            
+            response_text = get_response_text(response)
+            answer_length, confidence_score, hallucination_risk = score_and_cache(
+                prompt, embedding, response_text, get_chosen_logprobs(response)
+            )
+            token_count = get_token_count(response)
         
-        # Calculate hallucination risk
-        hallucination_risk = calculate_hallucination_risk(
-            response_text, prompt, confidence_score
+        # Queue telemetry and return response
+        metadata = record_success(
+            request_id, prompt, answer_length, confidence_score,
+            hallucination_risk, token_count, cache_hit,
+            latency_ms, start_time,
         )
-        
-        # Calculate metrics
-        latency_ms = (llm_end - llm_start) * 1000
-        answer_length = len(response_text.split())
-        token_count = response.usage_metadata.total_token_count if hasattr(response, 'usage_metadata') else 0
-        
-        # Prepare telemetry data
-        metrics_data = {
-            "model_name": MODEL_NAME,
-            "latency_ms": latency_ms,
-            "self_confidence": confidence_score,
-            "hallucination_risk": hallucination_risk,
-            "answer_length": answer_length,
-            "token_count": token_count
-        }
-        
-        log_data = {
-            "request_id": request_id,
-            "prompt_hash": hash_prompt(prompt),
-            "model_name": MODEL_NAME,
-            "latency_ms": latency_ms,
-            "hallucination_risk": hallucination_risk,
-            "self_confidence": confidence_score,
-            "answer_length": answer_length,
-            "status": "success"
-        }
-        
-        # Send telemetry (non-blocking)
-        send_metrics_to_datadog(metrics_data)
-        send_logs_to_datadog(log_data)
-        
-        # Return response
-        end_time = time.time()
         return jsonify({
             "request_id": request_id,
             "response": response_text,
-            "metadata": {
-                "latency_ms": round((end_time - start_time) * 1000, 2),
-                "confidence": round(confidence_score, 3),
-                "hallucination_risk": round(hallucination_risk, 3),
-                "model": MODEL_NAME
-            }
+            "metadata": metadata
         }), 200
         
     except Exception as e:
         # Log error
-        error_time = time.time()
-        error_data = {
-            "request_id": request_id,
-            "error": str(e),
-            "latency_ms": (error_time - start_time) * 1000,
-            "status": "error"
-        }
-        send_logs_to_datadog(error_data)
-        
-        # Send error metric
-        try:
-            with ApiClient(dd_configuration) as api_client:
-                api_instance = MetricsApi(api_client)
-                series = [
-                    MetricSeries(
-                        metric="llm.error.count",
-                        type=MetricIntakeType.UNSPECIFIED,
-                        points=[MetricPoint(timestamp=int(time.time()), value=1.0)],
-                        tags=[f"service:{SERVICE_NAME}", f"env:{ENVIRONMENT}"]
-                    )
-                ]
-                api_instance.submit_metrics(body=MetricPayload(series=series))
-        except:
-            pass
+        record_error(request_id, str(e), start_time)
         
         return jsonify({"error": str(e), "request_id": request_id}), 500
 
 
-if __name__ == '__main__':
+if __name__ == '__main__' and os.getenv('DEV'):
     port = int(os.getenv('PORT', 8080))
     app.run(host='0.0.0.0', port=port)
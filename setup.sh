@@ -324,7 +324,7 @@ ENVIRONMENT=$ENVIRONMENT
 SERVICE_NAME=$SERVICE_NAME
 
 # Optional (uncomment to override defaults)
-# MEMORY=1Gi
+# MEMORY=2Gi
 # CPU=1
 # TIMEOUT=300
 EOF
@@ -368,6 +368,7 @@ echo "1) Install Python dependencies:"
 echo "   python3 -m venv venv"
 echo "   source venv/bin/activate"
 echo "   pip install -r requirements.txt"
+echo "   pip install -r requirements-scripts.txt  # test_*.py scripts"
 echo ""
 echo "2) Deploy the service:"
 echo "   ./deploy.sh"
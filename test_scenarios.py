@@ -1,25 +1,84 @@
-import requests
-import json
+import asyncio
+import httpx
 import time
 
 # Configuration
 SERVICE_URL = "https://llm-observability-service-xxxx.run.app"  # Replace with your Cloud Run URL
 CHAT_ENDPOINT = f"{SERVICE_URL}/chat"
 
-def send_request(prompt, description):
-    """Send request and print results"""
-    print(f"\n{'='*60}")
-    print(f"TEST: {description}")
-    print(f"{'='*60}")
-    print(f"Prompt: {prompt[:100]}...")
-    
+SCENARIOS = [
+    # Test Case 1: Normal, factual query
+    {
+        "title": "SCENARIO 1: Normal Factual Query",
+        "expected": "Expected: Low risk, high confidence, fast response",
+        "prompt": "What is the capital of France?",
+        "description": "Simple factual question",
+    },
+    # Test Case 2: Ambiguous/uncertain query
+    {
+        "title": "SCENARIO 2: Ambiguous Query",
+        "expected": "Expected: Moderate-high risk, lower confidence, hedging language",
+        "prompt": "Will it rain in Chennai next Tuesday at 3pm?",
+        "description": "Specific future prediction (impossible to know)",
+    },
+    # Test Case 3: Complex reasoning query
+    {
+        "title": "SCENARIO 3: Complex Reasoning",
+        "expected": "Expected: Moderate risk, moderate confidence, higher latency",
+        "prompt": "Explain the philosophical implications of quantum entanglement on the nature of causality and determinism in a universe governed by both quantum mechanics and general relativity.",
+        "description": "Complex philosophical reasoning",
+    },
+    # Test Case 4: Prompt designed to trigger uncertainty
+    {
+        "title": "SCENARIO 4: Hallucination-Prone Query",
+        "expected": "Expected: HIGH RISK (>0.7), low confidence, should trigger alert",
+        "prompt": "Tell me about the biography of Dr. Xylophon Marthexius, the renowned 18th century Croatian mathematician who discovered the Theorem of Hyperbolic Infinities.",
+        "description": "Query about non-existent person/theorem",
+    },
+    # Test Case 5: Open-ended speculation
+    {
+        "title": "SCENARIO 5: Speculative Query",
+        "expected": "Expected: Moderate-high risk, lots of hedging language",
+        "prompt": "What will be the most important technological breakthrough in 2030?",
+        "description": "Pure speculation about future",
+    },
+    # Test Case 6: Very broad query (verbosity test)
+    {
+        "title": "SCENARIO 6: Overly Broad Query",
+        "expected": "Expected: Higher risk due to verbosity, longer latency",
+        "prompt": "Tell me everything about artificial intelligence.",
+        "description": "Extremely broad query",
+    },
+]
+
+
+async def send_request(client, prompt):
+    """Send request and return the response with its latency in ms"""
     start = time.time()
-    response = requests.post(
+    response = await client.post(
         CHAT_ENDPOINT,
         json={"prompt": prompt},
         headers={"Content-Type": "application/json"}
     )
     end = time.time()
+    return response, (end - start) * 1000
+
+
+def print_result(scenario, response, elapsed_ms=None):
+    """Print results; response is the exception if the request failed"""
+    print("\n" + "="*60)
+    print(scenario["title"])
+    print(scenario["expected"])
+    print("="*60)
+
+    print(f"\n{'='*60}")
+    print(f"TEST: {scenario['description']}")
+    print(f"{'='*60}")
+    print(f"Prompt: {scenario['prompt'][:100]}...")
+    
+    if isinstance(response, Exception):
+        print(f"\n✗ Request failed: {type(response).__name__}: {response}")
+        return
     
     if response.status_code == 200:
         data = response.json()
@@ -49,94 +108,39 @@ def send_request(prompt, description):
         print(f"\n✗ Error: {response.status_code}")
         print(f"  {response.text}")
     
-    print(f"\nTotal time: {(end - start) * 1000:.0f}ms")
-
-
-# Test Case 1: Normal, factual query
-print("\n" + "="*60)
-print("SCENARIO 1: Normal Factual Query")
-print("Expected: Low risk, high confidence, fast response")
-print("="*60)
-
-send_request(
-    "What is the capital of France?",
-    "Simple factual question"
-)
-
-time.sleep(2)  # Wait between requests
-
-
-# Test Case 2: Ambiguous/uncertain query
-print("\n" + "="*60)
-print("SCENARIO 2: Ambiguous Query")
-print("Expected: Moderate-high risk, lower confidence, hedging language")
-print("="*60)
-
-send_request(
-    "Will it rain in Chennai next Tuesday at 3pm?",
-    "Specific future prediction (impossible to know)"
-)
-
-time.sleep(2)
-
-
-# Test Case 3: Complex reasoning query
-print("\n" + "="*60)
-print("SCENARIO 3: Complex Reasoning")
-print("Expected: Moderate risk, moderate confidence, higher latency")
-print("="*60)
-
-send_request(
-    "Explain the philosophical implications of quantum entanglement on the nature of causality and determinism in a universe governed by both quantum mechanics and general relativity.",
-    "Complex philosophical reasoning"
-)
-
-time.sleep(2)
-
-
-# Test Case 4: Prompt designed to trigger uncertainty
-print("\n" + "="*60)
-print("SCENARIO 4: Hallucination-Prone Query")
-print("Expected: HIGH RISK (>0.7), low confidence, should trigger alert")
-print("="*60)
-
-send_request(
-    "Tell me about the biography of Dr. Xylophon Marthexius, the renowned 18th century Croatian mathematician who discovered the Theorem of Hyperbolic Infinities.",
-    "Query about non-existent person/theorem"
-)
-
-time.sleep(2)
-
-
-# Test Case 5: Open-ended speculation
-print("\n" + "="*60)
-print("SCENARIO 5: Speculative Query")
-print("Expected: Moderate-high risk, lots of hedging language")
-print("="*60)
-
-send_request(
-    "What will be the most important technological breakthrough in 2030?",
-    "Pure speculation about future"
-)
-
-time.sleep(2)
-
-
-# Test Case 6: Very broad query (verbosity test)
-print("\n" + "="*60)
-print("SCENARIO 6: Overly Broad Query")
-print("Expected: Higher risk due to verbosity, longer latency")
-print("="*60)
-
-send_request(
-    "Tell me everything about artificial intelligence.",
-    "Extremely broad query"
-)
+    print(f"\nTotal time: {elapsed_ms:.0f}ms")
+
+
+async def run_scenarios():
+    """Send all scenarios concurrently over one connection pool"""
+    async with httpx.AsyncClient(
+        http2=True,
+        timeout=60,
+        limits=httpx.Limits(max_keepalive_connections=10),
+    ) as client:
+        return await asyncio.gather(
+            *(send_request(client, scenario["prompt"]) for scenario in SCENARIOS),
+            return_exceptions=True,
+        )
+
+
+start = time.time()
+results = asyncio.run(run_scenarios())
+end = time.time()
+
+# Print in scenario order once all requests have completed; a failed
+# request is reported in place without hiding the others
+for scenario, result in zip(SCENARIOS, results):
+    if isinstance(result, Exception):
+        print_result(scenario, result)
+    else:
+        print_result(scenario, *result)
 
 
 print("\n" + "="*60)
 print("TESTING COMPLETE")
 print("="*60)
+print(f"\nWall time for {len(SCENARIOS)} concurrent requests: {(end - start) * 1000:.0f}ms")
 print("\nNext steps:")
 print("1. Open Datadog dashboard to view metrics")
 print("2. Check for alert triggers (especially Scenario 4)")